@@ -3,6 +3,11 @@
 pyinstaller XPSPRE.py --noconsole --hidden-import PySide2.QtXml --icon="logo.ico"
 
 copy "%cd%\normalization.py" "%cd%\dist\main\normalization.py"
+copy "%cd%\manipulation.py" "%cd%\dist\main\manipulation.py"
+copy "%cd%\energy_axis.py" "%cd%\dist\main\energy_axis.py"
+copy "%cd%\PHIMultipakSPE_reader.py" "%cd%\dist\main\PHIMultipakSPE_reader.py"
+copy "%cd%\project.py" "%cd%\dist\main\project.py"
+copy "%cd%\parse_cache.py" "%cd%\dist\main\parse_cache.py"
 copy "%cd%\resource.py" "%cd%\dist\main\resource.py"
 
 copy "%cd%\logo.ico" "%cd%\dist\main\logo.ico"
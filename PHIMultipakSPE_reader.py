@@ -68,77 +68,386 @@
 #   different binary datatype which is defined by '(3) datatype'.
 #   At the end of each spectra there might be also additional
 #   bytes until the next spectra starts.
+#   Files with several spatial areas ('NoSpatialArea', 'SpatialAreaDef')
+#   and/or several cycles (depth profiles) hold
+#   cycles * areas * NoSpectralReg spectra, ordered cycle by cycle,
+#   area by area, region by region.
 # =============================================================================
 
-from struct import unpack, calcsize
-
-import numpy as np
-import pandas as pd
+# pandas is only imported by the functions returning DataFrames, opening and
+# decoding files needs numpy alone.
 
+import mmap
+import os
+from struct import unpack
 
-file_path = './ex.SPE'
+import numpy as np
 
-with open(file_path, 'rb') as f:
-    s = f.read()
+from energy_axis import energy_axis
 
-# ahpos: ASCII Header Position
-# bhpos: Binary Header Position
-# shpos: Spectral Header Position
-ahpos = 0    
-bhpos = s.find(b'\r\nEOFH\r\n') + 8
-shpos = bhpos + 16
 
-# ASCII Header: basic information
-ascii_header = s[6:bhpos-8].decode('utf8').split('\r\n')
-keys = [infos.split(':')[0].strip(' ') for infos in ascii_header]
-vals = [infos.split(':')[1].strip(' ') for infos in ascii_header]
-ascii_header = dict(zip(keys, vals))
+SPECTRAL_REG_DEF = ['num1', 'num2', 'name', 'PHI_AtomicNumber', 'points',
+                    'step', 'start1', 'ende1', 'start2', 'ende2',
+                    'dwelltime', 'Epass', 'str']
 
-energy_ev = float(ascii_header['XraySource'].split(' ')[1])
-Ta, Tb = tuple(ascii_header['IntensityCalCoeff'].split(' '))
-Ta, Tb = float(Ta), float(Tb)
 
-SpectralRegDef = pd.DataFrame(
-    {vals[i].split(' ')[2]:vals[i].split(' ') for i in range(len(keys)) if keys[i] == 'SpectralRegDef'},
-    index = ['num1', 'num2', 'name', 'PHI_AtomicNumber', 'points', 
-             'step', 'start1', 'ende1', 'start2', 'ende2',
-             'dwelltime', 'Epass', 'str']
-    )
+class RegionDef():
+    '''One SpectralRegDef line of the ASCII header, fields already typed.'''
+    
+    __slots__ = SPECTRAL_REG_DEF
+    
+    def __init__(self, val):
+        fields = val.split(' ')
+        self.num1 = int(fields[0])
+        self.num2 = int(fields[1])
+        self.name = fields[2]
+        self.PHI_AtomicNumber = int(fields[3])
+        self.points = int(fields[4])
+        self.step = float(fields[5])
+        self.start1 = float(fields[6])
+        self.ende1 = float(fields[7])
+        self.start2 = float(fields[8])
+        self.ende2 = float(fields[9])
+        self.dwelltime = float(fields[10])
+        self.Epass = float(fields[11])
+        self.str = ' '.join(fields[12:])
+    
+    def __repr__(self):
+        return f'RegionDef({" ".join(str(getattr(self, field)) for field in SPECTRAL_REG_DEF)})'
 
-# get the number of spectra
-binary_header = unpack('4I', s[bhpos:shpos])
-_, spectranum, _ ,_ = binary_header
+# 'datatype' field of the spectral header: numpy dtype of the spectrum
+DATATYPES = {b'f4': '<f4', b'f8': '<f8'}
 
-# get the overall spectral information
-fmt = '8I3sI3s3I3s3I2s5I' * spectranum
-bytesnum = calcsize(fmt)
-spectral_header = unpack(fmt, s[shpos:shpos+bytesnum])
-datastart = [spectral_header[n*24+20] for n in range(spectranum)]
+# (3) Spectral Header, 24 fields * 4 bytes
+SPECTRAL_HEADER_DTYPE = np.dtype([
+    ('spectranum', '<u4'), ('bool1', '<u4'), ('bool2', '<u4'), ('spectranum2', '<u4'),
+    ('bool4', '<u4'), ('points', '<u4'), ('bool5', '<u4'), ('bool6', '<u4'),
+    ('char1', 'S4'), ('num8', '<u4'), ('char2', 'S4'), ('num10', '<u4'),
+    ('num11', '<u4'), ('num12', '<u4'), ('yunit', 'S4'), ('num14', '<u4'),
+    ('num15', '<u4'), ('num16', '<u4'), ('datatype', 'S4'), ('datalen', '<u4'),
+    ('datastart', '<u4'), ('num20', '<u4'), ('num21', '<u4'), ('offset2', '<u4'),
+    ])
 
-# get the actual spectra data and load into 'data' DataFrame
-data = pd.DataFrame()
 
-for n in range(spectranum):
-    spectrumname = SpectralRegDef.columns[n]
-    points = int(SpectralRegDef[spectrumname].points)
-    step = float(SpectralRegDef[spectrumname].step)
-    start1 = float(SpectralRegDef[spectrumname].start1)
-    ende1 = float(SpectralRegDef[spectrumname].ende1)
+def read_ascii_header(f):
+    '''
+    Read f from its start up to 'EOFH', never touching the binary part.
+    Return (keys, vals, bhpos), one key/value per line of the ASCII header.
+    '''
+    s = b''
+    while b'\r\nEOFH\r\n' not in s:
+        chunk = f.read(4096)
+        if not chunk:
+            raise ValueError(f'{f.name} is not a valid SPE file (EOFH not found).')
+        s += chunk
+    
+    bhpos = s.find(b'\r\nEOFH\r\n') + 8
     
-    spectrumdata = s[bhpos:][datastart[n]:datastart[n]+8*points]
+    ascii_header = s[6:bhpos-8].decode('utf8').split('\r\n')
+    keys = [infos.split(':')[0].strip(' ') for infos in ascii_header]
+    vals = [infos.split(':', 1)[1].strip(' ') for infos in ascii_header]
+    return keys, vals, bhpos
 
-    df_BE = pd.DataFrame(
-        np.arange(start1, ende1+step, step),
-        columns = [f'{spectrumname}_BE']
-        )
-    data = pd.concat([data, df_BE], axis=1)
 
-    df_Intensity = pd.DataFrame(
-        np.array(unpack('d'*points, spectrumdata)),
-        columns = [f'{spectrumname}_Intensity']
-        )
-    data = pd.concat([data, df_Intensity], axis=1)
+def scan_headers(root):
+    '''
+    Catalog of all .SPE files under root (a directory tree or a list of files),
+    built from the ASCII headers only. One row per region:
+    file, FileDate, AcqFilename, XraySource, name, points, step, start1, ende1, Epass.
+    
+    >>> catalog = scan_headers('D:/XPS')
+    >>> catalog.query("name == 'Ag3d' and Epass == 58.7")
+    '''
+    if isinstance(root, (str, os.PathLike)):
+        file_paths = [os.path.join(dirpath, file_name)
+                      for dirpath, _, file_names in os.walk(root)
+                      for file_name in sorted(file_names) if file_name.lower().endswith('.spe')]
+    else:
+        file_paths = list(root)
+    
+    import pandas as pd
+    
+    rows = []
+    for file_path in file_paths:
+        # a file with an unreadable header or SpectralRegDef line is skipped
+        # as a whole
+        try:
+            with open(file_path, 'rb') as f:
+                keys, vals, _ = read_ascii_header(f)
+            
+            ascii_header = dict(zip(keys, vals))
+            file_rows = []
+            for i in range(len(keys)):
+                if keys[i] == 'SpectralRegDef':
+                    region = RegionDef(vals[i])
+                    file_rows.append((file_path,
+                                      ascii_header.get('FileDate', ''),
+                                      ascii_header.get('AcqFilename', ''),
+                                      ascii_header.get('XraySource', ''),
+                                      region.name,
+                                      region.points,
+                                      region.step,
+                                      region.start1,
+                                      region.ende1,
+                                      region.Epass))
+        except (OSError, ValueError, IndexError):
+            continue
+        rows.extend(file_rows)
+    
+    return pd.DataFrame(rows,
+                        columns = ['file', 'FileDate', 'AcqFilename', 'XraySource',
+                                   'name', 'points', 'step', 'start1', 'ende1', 'Epass'])
 
 
+class SpeFile():
+    '''
+    PHI MultiPak .SPE file.
+    
+    Only the ASCII header and the binary/spectral headers are parsed on open,
+    each region of SpectralRegDef is decoded on first access and then cached.
+    
+    The spectra are not copied out of the file: the intensities are read-only
+    np.frombuffer views on a memory map of the file, with the dtype given by
+    the 'datatype' field (f4/f8) of each spectral header.
+    
+    >>> with SpeFile('./ex.SPE') as spe:
+    ...     BE, Intensity = spe['C1s']
+    '''
+    
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.regions = {}
+        self.mm = None
+        
+        with open(file_path, 'rb') as f:
+            self.read_ascii_header(f)
+            self.read_binary_header(f)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+    
+    def open(self):
+        if self.mm is None:
+            with open(self.file_path, 'rb') as f:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.mm
+    
+    def close(self):
+        self.regions = {}
+        if self.mm is not None:
+            try:
+                self.mm.close()
+            except BufferError:
+                # arrays handed out still reference the map, it is released
+                # together with the last of them
+                pass
+            self.mm = None
+    
+    def read_ascii_header(self, f):
+        # ahpos: ASCII Header Position
+        # bhpos: Binary Header Position
+        # shpos: Spectral Header Position
+        keys, vals, self.bhpos = read_ascii_header(f)
+        self.ahpos = 0
+        self.shpos = self.bhpos + 16
+        
+        # ASCII Header: basic information
+        self.ascii_header = dict(zip(keys, vals))
+        
+        self.energy_ev = float(self.ascii_header['XraySource'].split(' ')[1])
+        Ta, Tb = tuple(self.ascii_header['IntensityCalCoeff'].split(' '))
+        self.Ta, self.Tb = float(Ta), float(Tb)
+        self.work_function = float(self.ascii_header.get('AnalyserWorkFcn', '0').split(' ')[0])
+        
+        # [RegionDef] in header order, region names may repeat
+        self.SpectralRegDef = [RegionDef(vals[i]) for i in range(len(keys)) if keys[i] == 'SpectralRegDef']
+        
+        self.SpatialAreaDef = [vals[i].split(' ')[1] for i in range(len(keys)) if keys[i] == 'SpatialAreaDef']
+    
+    def read_binary_header(self, f):
+        f.seek(self.bhpos)
+        
+        # get the number of spectra
+        binary_header = f.read(16)
+        if len(binary_header) != 16:
+            raise ValueError(f'{self.file_path} is truncated (binary header missing).')
+        binary_header = unpack('4I', binary_header)
+        _, self.spectranum, _ ,_ = binary_header
+        
+        # get the overall spectral information, one record per spectrum
+        self.spectral_header = np.frombuffer(f.read(SPECTRAL_HEADER_DTYPE.itemsize * self.spectranum),
+                                             dtype = SPECTRAL_HEADER_DTYPE,
+                                             count = self.spectranum)
+        self.datastart = self.spectral_header['datastart'].astype(np.int64)
+        self.points = self.spectral_header['points'].astype(np.int64)
+        self.names = [region.name for region in self.SpectralRegDef][:self.spectranum]
+        # name: first region of that name
+        self.index = {}
+        for n, name in enumerate(self.names):
+            self.index.setdefault(name, n)
+        
+        for datatype in np.unique(self.spectral_header['datatype']):
+            if datatype not in DATATYPES:
+                raise ValueError(f'{self.file_path} has an unknown spectrum datatype {datatype.decode("latin1")!r}.')
+        dtypes = {datatype: np.dtype(dtype) for datatype, dtype in DATATYPES.items()}
+        self.datatype = [dtypes[datatype] for datatype in self.spectral_header['datatype']]
+    
+    @property
+    def areas(self):
+        areas = int(self.ascii_header.get('NoSpatialArea', 1)) or 1
+        names = self.SpatialAreaDef[:areas]
+        return names + [f'Area{i+1}' for i in range(len(names), areas)]
+    
+    @property
+    def cycles(self):
+        return max(self.spectranum // (len(self.names) * len(self.areas)), 1) if self.names else 0
+    
+    def iter_spectra(self):
+        '''
+        Stream all spectra of multi-area / multi-cycle files, yield
+        (area, cycle, region, BE, Intensity) one spectrum at a time.
+        Intensity is a view on the memory map, nothing is accumulated.
+        
+        >>> for area, cycle, region, BE, Intensity in spe.iter_spectra():
+        ...     pass
+        '''
+        names, areas = self.names, self.areas
+        
+        for n in range(self.spectranum):
+            cycle, rest = divmod(n, len(names) * len(areas))
+            area, region = divmod(rest, len(names))
+            name = names[region]
+            points = int(self.points[n])
+            BE = energy_axis(self.SpectralRegDef[region].start1,
+                             self.SpectralRegDef[region].step,
+                             points)
+            
+            Intensity = np.frombuffer(self.open(),
+                                      dtype = self.datatype[n],
+                                      count = points,
+                                      offset = self.bhpos + int(self.datastart[n]))
+            yield areas[area], cycle, name, BE, Intensity
+    
+    def __len__(self):
+        return len(self.names)
+    
+    def __iter__(self):
+        return iter(self.names)
+    
+    def __contains__(self, name):
+        return name in self.index
+    
+    def __getitem__(self, name):
+        '''(BE, Intensity) of the region, the first one if the name repeats.'''
+        return self.region(self.index[name])
+    
+    def region(self, n):
+        '''(BE, Intensity) of the n-th region in header order.'''
+        if n not in self.regions:
+            self.regions[n] = self.read_region(n)
+        return self.regions[n]
+    
+    def read_region(self, n):
+        '''
+        Decode the n-th region, return (BE, Intensity).
+        BE is an EnergyAxis of exactly 'points' values, shared between
+        regions with the same start1/step/points.
+        '''
+        points = int(self.points[n])
+        
+        BE = energy_axis(self.SpectralRegDef[n].start1, self.SpectralRegDef[n].step, points)
+        Intensity = np.frombuffer(self.open(),
+                                  dtype = self.datatype[n],
+                                  count = points,
+                                  offset = self.bhpos + int(self.datastart[n]))
+        return BE, Intensity
+    
+    def transmission(self, BE, Epass):
+        '''
+        Analyser transmission from IntensityCalCoeff (Ta, Tb):
+        T = (Ta^2 / (Ta^2 + R^2))^Tb, R = KE / Epass, KE = hv - BE - work function.
+        BE and Epass may be arrays of any matching shape.
+        '''
+        R = (self.energy_ev - BE - self.work_function) / Epass
+        return (self.Ta**2 / (self.Ta**2 + R**2)) ** self.Tb
+    
+    def corrected(self):
+        '''
+        Transmission corrected count rates of all regions, {name: (BE, cps)}.
+        Regions not already in c/s are divided by their dwelltime first.
+        All regions are corrected in one vectorized pass over the
+        concatenated spectra.
+        '''
+        regions = [self.region(n) for n in range(len(self.names))]
+        if not regions:
+            return {}
+        
+        lengths = np.array([len(Intensity) for _, Intensity in regions], dtype=np.int64)
+        region_defs = self.SpectralRegDef[:len(self.names)]
+        Epass = np.repeat([region.Epass for region in region_defs], lengths)
+        dwelltime = np.repeat([1.0 if self.spectral_header['yunit'][n] == b'c/s' else region.dwelltime
+                               for n, region in enumerate(region_defs)], lengths)
+        
+        BE = np.concatenate([np.asarray(BE) for BE, _ in regions])
+        Intensity = np.concatenate([Intensity for _, Intensity in regions]).astype(np.float64)
+        cps = Intensity / (dwelltime * self.transmission(BE, Epass))
+        
+        cps = np.split(cps, np.cumsum(lengths)[:-1])
+        return {name: (regions[n][0], cps[n]) for name, n in self.index.items()}
+    
+    def to_dict(self, corrected=False):
+        '''All regions: {name: (BE, Intensity)}, transmission corrected if asked.'''
+        if corrected:
+            return self.corrected()
+        return {name: self[name] for name in self.names}
+    
+    def to_dataframe(self):
+        '''
+        All regions in one wide DataFrame: {name}_BE, {name}_Intensity,
+        shorter regions padded with NaN. Built from one preallocated array.
+        '''
+        import pandas as pd
+        
+        regions = [self.region(n) for n in range(len(self.names))]
+        rows = max([max(len(BE), len(Intensity)) for BE, Intensity in regions], default=0)
+        
+        data = np.full((rows, 2*len(regions)), np.nan)
+        for i, (BE, Intensity) in enumerate(regions):
+            data[:len(BE), 2*i] = BE
+            data[:len(Intensity), 2*i+1] = Intensity
+        
+        return pd.DataFrame(data,
+                            columns = [f'{name}_{suffix}' for name in self.names for suffix in ['BE', 'Intensity']])
+    
+    def to_long(self):
+        '''
+        All regions in one long DataFrame with columns region, BE, Intensity,
+        one row per data point. Built from preallocated buffers.
+        '''
+        import pandas as pd
+        
+        regions = [self.region(n) for n in range(len(self.names))]
+        lengths = np.array([min(len(BE), len(Intensity)) for BE, Intensity in regions], dtype=np.int64)
+        ends = np.cumsum(lengths)
+        
+        BE_all = np.empty(ends[-1] if len(ends) else 0)
+        Intensity_all = np.empty_like(BE_all)
+        for (BE, Intensity), n, end in zip(regions, lengths, ends):
+            BE_all[end-n:end] = BE[:n]
+            Intensity_all[end-n:end] = Intensity[:n]
+        
+        # repeated region names share one category
+        codes = [list(self.index).index(name) for name in self.names]
+        return pd.DataFrame({'region': pd.Categorical.from_codes(np.repeat(codes, lengths),
+                                                                 categories = list(self.index)),
+                             'BE': BE_all,
+                             'Intensity': Intensity_all})
 
 
+if __name__ == '__main__':
+    with SpeFile('./ex.SPE') as spe:
+        data = spe.to_dataframe()
+    print(data)
@@ -7,11 +7,10 @@
 
 __version__ = '3.1'
 
+import os
 from functools import partial
-from struct import pack
 
 import pandas as pd
-import numpy as np
 from qtpy.QtCore import Qt
 from PySide2.QtGui import QIcon
 from PySide2.QtUiTools import QUiLoader
@@ -22,6 +21,9 @@ from matplotlib.backends.backend_qt5agg import (NavigationToolbar2QT, FigureCanv
 
 import resource
 from normalization import Normalization
+from manipulation import Manipulation
+from parse_cache import ParseCache
+from project import save_session, load_session
 
 
 def RC_Initial():
@@ -101,118 +103,6 @@ class MplWidget(QWidget):
         self.setLayout(vertical_layout)
 
 
-class Manipulation():
-
-    def __init__(self):
-        self.initial_data()
-    
-    def initial_data(self):
-        self.Elements_Contents = None
-        self.Full_Scan_BE = None
-        self.Full_Scan_Intensity = None
-        self.Fine_Scan_Elements = None 
-        self.Fine_Scan_BE = {}
-        self.Fine_Scan_Intensity = {}
-        self.delta_BE = None
-
-    def read_element_content(self, address):
-        file = pd.read_table(address)
-        elements = file.values[-2:][0][0].strip().split()
-        contents = file.values[-2:][1][0].strip().split()
-        self.Elements_Contents = dict(zip(elements, list(map(float, contents))))
-
-    def read_full_scan(self, address):        
-        file = pd.read_csv(address,
-                           names = ['BE', 'Intensity'],
-                           skiprows = 4)
-        
-        self.Full_Scan_BE = file['BE'].values
-        self.Full_Scan_Intensity = file['Intensity'].values
-        
-    def read_fine_scan(self, address):
-        file = pd.read_csv(address,
-                           nrows = 3)
-        
-        self.Fine_Scan_Elements = file.values[1].tolist()[::2]
-        
-        name = [f'{element}_{suffix}' \
-                for element in self.Fine_Scan_Elements \
-                for suffix in ['BE', 'Intensity']]
-        
-        file = pd.read_csv(address,
-                           names = name,
-                           skiprows = 4)
-
-        for element in self.Fine_Scan_Elements:
-            self.Fine_Scan_BE[element] = file[f'{element}_BE'].values
-            self.Fine_Scan_Intensity[element] = file[f'{element}_Intensity'].values
-            
-            nan_index = np.where(np.isnan(self.Fine_Scan_BE[element]))[0]
-            self.Fine_Scan_BE[element] = np.delete(self.Fine_Scan_BE[element], nan_index, axis=0)
-            self.Fine_Scan_Intensity[element] = np.delete(self.Fine_Scan_Intensity[element], nan_index, axis=0)
-    
-    def Elements_Contents_Update(self):
-        if len(self.Fine_Scan_Elements) > len(self.Elements_Contents):
-            elements = list(set(self.Fine_Scan_Elements).difference(set(self.Elements_Contents)))
-            for element in elements:
-                self.Elements_Contents[element] = 0
-    
-    def calibrate_BE(self):
-        for element in self.Fine_Scan_BE:
-            for i in range(len(self.Fine_Scan_BE[element])):
-                self.Fine_Scan_BE[element][i] += self.delta_BE 
-
-    def check_files(self, file_names, file_address):
-        correct_file_names = [f'{file_address}N-a.txt', f'{file_address}S-a.csv', f'{file_address}N-a.csv']
-        
-        if len(file_names) == 3 and set(file_names).difference(set(correct_file_names)) == set():
-            self.initial_data()
-            self.read_element_content(correct_file_names[0])
-            self.read_full_scan(correct_file_names[1])
-            self.read_fine_scan(correct_file_names[2])
-            self.Elements_Contents_Update()
-            self.delta_BE = 0.0
-            return True
-        else:
-            return False
-    
-    def calculate_atomic_ratio(self, element_1, element_2):
-        content_1 = self.Elements_Contents[element_1]
-        content_2 = self.Elements_Contents[element_2]
-        return f'{(content_1/content_2):.2f}'
-    
-    def save_txt(self, address):
-        for element in self.Fine_Scan_Elements:
-            np.savetxt(f'{address}{element}.txt',
-                       np.column_stack((self.Fine_Scan_BE[element], self.Fine_Scan_Intensity[element])),
-                       fmt = '%f')
-    
-    def save_xps(self, path):
-        s = b''
-        num = len(self.Fine_Scan_Elements)
-        
-        for element in self.Fine_Scan_Elements:
-            points = len(self.Fine_Scan_BE[element])
-            bin_points = pack('h', points)
-            bin_points_ = pack('h', points+1)
-            
-            bin_BE = [pack('f', BE) for BE in self.Fine_Scan_BE[element]]
-            bin_Intensity = [pack('f', Intensity) for Intensity in self.Fine_Scan_Intensity[element]]
-            bin_tail = pack('4f', np.max(self.Fine_Scan_BE[element]), np.min(self.Fine_Scan_BE[element]),
-                            np.max(self.Fine_Scan_Intensity[element]), np.min(self.Fine_Scan_Intensity[element]))
-            
-            s += b'\x44\x50' + bin_points + b'\xff\xff\x00\x00' + b'\x20'*20 + bin_points + \
-            b'\x01\x00' + bin_points_ + b'\x00'*10 + b''.join(bin_BE) + \
-            b'\x01\x00' + bin_points_ + b'\x00'*10 + b''.join(bin_Intensity) + bin_tail + b'\x00'*60 + \
-            (b'\x01\x00' + bin_points_ + b'\x00'*10 + b'\x00'*points*4)*6 + b'\x00' * 18
-        
-        s = b'\x58\x50\x53\x50\x45\x41\x4b\x20\x34\x2e\x30' + s + \
-        b'\x44\x41'*(61-num) + b'\x00'*80  + b'\x08\x00\x00\x00'
-        
-        with open(path, 'wb') as f:
-            f.write(s)
-
-
 class CalculatorWindow():
     
     def __init__(self):
@@ -286,13 +176,22 @@ class ComparationWindow():
     def openFile_dialog(self):
         self.file_path, _ = QFileDialog.getOpenFileName(self.ui_comparation,
                                                         'Select the Element Spectrum to open',
-                                                        filter='Data files (*.txt *.csv *.cp)')
+                                                        filter='Data files (*.txt *.csv *.cp *.xpp)')
         self.ui_comparation.lineEdit_1.setText(self.file_path)
         
         if self.file_path.endswith('.cp'):
             self.all_data = pd.read_pickle(self.file_path)
             self.sample_names = [name.split('_')[0] for name in self.all_data.columns[::2]]
             self.recover_plot()
+        elif self.file_path.endswith('.xpp'):
+            try:
+                all_data = load_session(self.file_path)
+            except ValueError:
+                all_data = None
+            if all_data is not None:
+                self.all_data = all_data
+                self.sample_names = [name.split('_')[0] for name in self.all_data.columns[::2]]
+                self.recover_plot()
     
     def recover_plot(self):
         self.ui_comparation.widget.canvas.axes.clear()
@@ -386,12 +285,16 @@ class ComparationWindow():
         if len( self.all_data) != 0:
             path, _ = QFileDialog.getSaveFileName(self.ui_comparation,
                                                   'Save',
-                                                  filter='Data files (*.cp)')
-            if path.endswith('.cp'):
+                                                  filter='XPSPRE project (*.xpp);;Data files (*.cp)')
+            if path.endswith('.xpp'):
+                save_session(path, comparison=self.all_data)
+            elif path.endswith('.cp'):
                 self.all_data.to_pickle(path)
-                QMessageBox.information(self.ui_comparation,
-                                        'INFO',
-                                        'File saved.')
+            else:
+                return
+            QMessageBox.information(self.ui_comparation,
+                                    'INFO',
+                                    'File saved.')
 
 
 class RetrieveWindow():
@@ -437,7 +340,7 @@ class ViewALLWindow():
 class MainWindow():
     
     def __init__(self):
-        self.Manip = Manipulation()
+        self.Manip = Manipulation(cache=ParseCache())
         
         loader = QUiLoader()
         loader.registerCustomWidget(MplWidget)
@@ -512,10 +415,13 @@ class MainWindow():
     
     def import_files(self):
         file_names, _ = QFileDialog.getOpenFileNames(self.ui,
-                                                    'Select the three files to open',
-                                                    filter='Data files (N-a.csv N-a.txt S-a.csv)')
+                                                    'Select the three files (or .SPE / .xps / .xpp files) to open',
+                                                    filter='Data files (N-a.csv N-a.txt S-a.csv *.SPE *.spe *.xps *.xpp)')
         if len(file_names) != 0:
-            self.file_address = file_names[0][:-7]
+            if file_names[0].lower().endswith(('.spe', '.xps', '.xpp')):
+                self.file_address = f'{os.path.splitext(file_names[0])[0]}_'
+            else:
+                self.file_address = file_names[0][:-7]
             
             if self.Manip.check_files(file_names, self.file_address) == True:
                 self.clear_ui_contents()
@@ -528,7 +434,7 @@ class MainWindow():
             else:
                 QMessageBox.warning(self.ui,
                                     'ERROR',
-                                    'Please select the three files correctly !\nElement Content (.txt)\nFine Scan (.csv)\nFull Scan (.csv)')
+                                    'Please select the three files correctly !\nElement Content (.txt)\nFine Scan (.csv)\nFull Scan (.csv)\nor PHI MultiPak files (.SPE)\nor one XPSPEAK file (.xps)\nor one XPSPRE project (.xpp)')
 
     def export_spectra_files(self):
         if self.Manip.delta_BE == 0.0:
@@ -554,21 +460,26 @@ class MainWindow():
                                     QMessageBox.Yes, QMessageBox.No) == QMessageBox.Yes:
                 path, _ = QFileDialog.getSaveFileName(self.ui,
                                                       'Save',
-                                                      filter='Data files (*.xps)')
-                if path.endswith('.xps'):
-                    self.Manip.save_xps(path)
-                    QMessageBox.information(self.ui,
-                                        'INFO',
-                                        'Spectra files have been exported in .xps format.')
+                                                      filter='XPSPEAK files (*.xps);;NumPy archive (*.npz);;XPSPRE project (*.xpp)')
+                self.save_xpsfile(path)
         elif self.Manip.delta_BE != None:
             path, _ = QFileDialog.getSaveFileName(self.ui,
                                                   'Save',
-                                                  filter='Data files (*.xps)')
-            if path.endswith('.xps'):
-                self.Manip.save_xps(path)
-                QMessageBox.information(self.ui,
-                                        'INFO',
-                                        'Spectra files have been exported in .xps format.')
+                                                  filter='XPSPEAK files (*.xps);;NumPy archive (*.npz);;XPSPRE project (*.xpp)')
+            self.save_xpsfile(path)
+    
+    def save_xpsfile(self, path):
+        if path.endswith('.xps'):
+            self.Manip.save_xps(path)
+        elif path.endswith('.npz'):
+            self.Manip.save_npz(path)
+        elif path.endswith('.xpp'):
+            save_session(path, self.Manip)
+        else:
+            return
+        QMessageBox.information(self.ui,
+                                'INFO',
+                                f'Spectra files have been exported in {os.path.splitext(path)[1]} format.')
     
     def run_calibrate(self):
 #     '''
@@ -580,18 +491,34 @@ class MainWindow():
         if self.Manip.Fine_Scan_Elements != None:
             Standard_BE = self.ui.lineEdit_1.text()
             Measured_BE = self.ui.lineEdit_2.text()
+            
+            # nothing picked: locate the peak of the selected element (C1s by default)
+            if Measured_BE.strip() == '':
+                item = self.ui.listWidget.currentItem()
+                element = item.text().split('      ')[0] if item is not None else 'C1s'
+                if element in self.Manip.Fine_Scan_Elements:
+                    Measured_BE = f'{self.Manip.find_reference_peak(element) + self.Manip.delta_BE:.3f}'
+                    self.ui.lineEdit_2.setText(Measured_BE)
+                    # select the reference, so the redraw below shows it
+                    if item is None:
+                        items = self.ui.listWidget.findItems(f'{element}      ', Qt.MatchStartsWith)
+                        if items:
+                            self.ui.listWidget.setCurrentItem(items[0])
     
             try:
-                self.Manip.delta_BE = float(Standard_BE) - float(Measured_BE)
+                # Measured_BE is picked on the plot, i.e. already shifted by the current delta_BE
+                delta_BE = float(Standard_BE) - float(Measured_BE) + self.Manip.delta_BE
             except ValueError:
                 pass
             else:
-                self.Manip.calibrate_BE()
+                self.Manip.calibrate_BE(delta_BE)
                 QMessageBox.information(self.ui,
                                         'INFO',
                                         'Calibration finished.')
-                self.ui.MplWidget.canvas.axes.clear()
-                self.draw()           
+                # draw() plots the selected element, nothing to redraw without one
+                if self.ui.listWidget.currentItem() is not None:
+                    self.ui.MplWidget.canvas.axes.clear()
+                    self.draw()
         
     def draw(self):
         
@@ -650,11 +577,12 @@ class MainWindow():
                 ax.invert_xaxis()
                 ax.legend()
      
-            ax = self.vie.ui_viewall.widget.canvas.figure.add_subplot((style//100) * 100 + 10 + (style//100))
-            ax.plot(self.Manip.Full_Scan_BE, self.Manip.Full_Scan_Intensity, label='Full Scan', c='black')
-            ax.invert_xaxis()
-            ax.set_xlabel('B.E. (eV)')
-            ax.legend()
+            if self.Manip.Full_Scan_BE is not None:
+                ax = self.vie.ui_viewall.widget.canvas.figure.add_subplot((style//100) * 100 + 10 + (style//100))
+                ax.plot(self.Manip.Full_Scan_BE, self.Manip.Full_Scan_Intensity, label='Full Scan', c='black')
+                ax.invert_xaxis()
+                ax.set_xlabel('B.E. (eV)')
+                ax.legend()
             
             self.vie.ui_viewall.widget.canvas.draw()
     
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#coding:utf-8
+# =============================================================================
+# Affine energy axis: BE[i] = start + i * step, i = 0 ... points-1
+# =============================================================================
+
+from functools import lru_cache
+
+import numpy as np
+
+
+class EnergyAxis():
+    '''
+    Energy axis stored as (start, step, points).
+
+    Indexing, slicing and calibration shifts cost O(1); the float64 array is
+    only built when numpy asks for it (np.asarray, plotting, export) and is
+    then kept, read-only, on the instance. Axes are immutable, regions with
+    the same definition share one object through energy_axis().
+    
+    It is a storage format, not an ndarray substitute: arithmetic other than
+    a shift, comparisons with arrays and reductions need np.asarray(axis).
+    Manipulation only hands out ndarrays (Fine_Scan_BE, Full_Scan_BE).
+    '''
+
+    __slots__ = ('start', 'step', 'points', '_values')
+
+    def __init__(self, start, step, points):
+        self.start = float(start)
+        self.step = float(step)
+        self.points = int(points)
+        self._values = None
+
+    @classmethod
+    def from_array(cls, values, atol=1e-6):
+        '''EnergyAxis if values are evenly spaced, else values unchanged.'''
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) < 2:
+            return values
+        axis = cls(values[0], (values[-1] - values[0]) / (len(values) - 1), len(values))
+        if np.allclose(values, axis.values, rtol=0, atol=atol):
+            return axis
+        return values
+
+    @property
+    def stop(self):
+        return self.start + (self.points - 1) * self.step
+
+    @property
+    def values(self):
+        if self._values is None:
+            self._values = self.start + self.step * np.arange(self.points)
+            self._values.flags.writeable = False
+        return self._values
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.values.copy() if copy else self.values
+        return self.values.astype(dtype)
+
+    def __len__(self):
+        return self.points
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            r = range(self.points)[index]
+            return EnergyAxis(self.start + r.start * self.step, r.step * self.step, len(r))
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += self.points
+            if not 0 <= index < self.points:
+                raise IndexError('EnergyAxis index out of range')
+            return self.start + index * self.step
+        return self.values[index]
+
+    def shift(self, delta):
+        return EnergyAxis(self.start + delta, self.step, self.points)
+
+    def __add__(self, delta):
+        return self.shift(delta)
+
+    __radd__ = __add__
+
+    def __sub__(self, delta):
+        return self.shift(-delta)
+
+    def __eq__(self, other):
+        if isinstance(other, EnergyAxis):
+            return (self.start, self.step, self.points) == (other.start, other.step, other.points)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((self.start, self.step, self.points))
+
+    def __repr__(self):
+        return f'EnergyAxis(start={self.start}, step={self.step}, points={self.points})'
+
+
+@lru_cache(maxsize=4096)
+def energy_axis(start, step, points):
+    '''Shared EnergyAxis, regions with identical definitions get the same object.'''
+    return EnergyAxis(start, step, points)
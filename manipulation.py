@@ -0,0 +1,579 @@
+#!/usr/bin/env python
+#coding:utf-8
+# =============================================================================
+# Data layer of XPSPRE: import, calibration and export of the spectra.
+#
+# No Qt / matplotlib here, so scripts and process-pool workers can use it
+# without the GUI. pandas, slow to import, is only imported by the text
+# readers that need it.
+# =============================================================================
+
+from collections.abc import Mapping
+from struct import pack_into, unpack_from
+from types import MappingProxyType
+
+import numpy as np
+
+from energy_axis import EnergyAxis
+from PHIMultipakSPE_reader import SpeFile
+from project import load_session, put_BE, get_BE
+
+
+class CalibratedBE(Mapping):
+    '''
+    Read-only {element: BE + delta_BE} view on Manipulation.Fine_Scan_BE_raw.
+    The offset is applied when an element is accessed, so changing delta_BE
+    costs O(1) and calibrations never stack on each other. The raw BE may be
+    an EnergyAxis, an ndarray is always handed out.
+    '''
+    
+    def __init__(self, manip):
+        self.manip = manip
+    
+    def __getitem__(self, element):
+        BE = np.asarray(self.manip.Fine_Scan_BE_raw[element])
+        if not self.manip.delta_BE:
+            return BE
+        return BE + self.manip.delta_BE
+    
+    def __iter__(self):
+        return iter(self.manip.Fine_Scan_BE_raw)
+    
+    def __len__(self):
+        return len(self.manip.Fine_Scan_BE_raw)
+
+
+def read_only(array):
+    if isinstance(array, np.ndarray):
+        array.flags.writeable = False
+    return array
+
+
+class Manipulation():
+
+    def __init__(self, cache=None):
+        # ParseCache of the parsed export files, None to always parse
+        self.cache = cache
+        self.initial_data()
+    
+    def initial_data(self):
+        # files read on first access of Elements_Contents / Full_Scan_*
+        self.element_content_address = None
+        self.full_scan_address = None
+        self.Elements_Contents = None
+        self.Ratio_Elements = []
+        self.Ratio_Index = {}
+        self.Full_Scan_BE = None
+        self.Full_Scan_Intensity = None
+        self.Fine_Scan_Elements = None 
+        self.Fine_Scan_BE_raw = {}
+        self.Fine_Scan_BE = CalibratedBE(self)
+        self.Fine_Scan_Intensity = {}
+        self.delta_BE = None
+
+    @property
+    def Elements_Contents(self):
+        '''
+        Read-only {element: content}. Assign a whole new dict, or change one
+        element with set_element_content, so the ratio matrix stays in step.
+        '''
+        if self.element_content_address is not None:
+            address, self.element_content_address = self.element_content_address, None
+            self.read_element_content(address)
+            self.Elements_Contents_Update()
+        if self._Elements_Contents is None:
+            return None
+        return MappingProxyType(self._Elements_Contents)
+    
+    @Elements_Contents.setter
+    def Elements_Contents(self, Elements_Contents):
+        self.element_content_address = None
+        self._Elements_Contents = None if Elements_Contents is None else dict(Elements_Contents)
+        self._Atomic_Ratio_Matrix = None
+        self.Ratio_Elements = []
+        self.Ratio_Index = {}
+    
+    @property
+    def Atomic_Ratio_Matrix(self):
+        '''
+        Ratio_Elements x Ratio_Elements array of content_i / content_j,
+        built on first use, then kept up to date by set_element_content.
+        Ratios with a zero denominator are inf / nan.
+        '''
+        if self._Atomic_Ratio_Matrix is None and self.Elements_Contents is not None:
+            self.Ratio_Elements = list(self.Elements_Contents)
+            self.Ratio_Index = {element: i for i, element in enumerate(self.Ratio_Elements)}
+            contents = np.array(list(self.Elements_Contents.values()), dtype=np.float64)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self._Atomic_Ratio_Matrix = contents[:, None] / contents[None, :]
+        return self._Atomic_Ratio_Matrix
+    
+    def set_element_content(self, element, content):
+        '''Change (or add) one content, only its row and column of the ratio matrix are updated.'''
+        # a pending N-a.txt is parsed first
+        self.Elements_Contents
+        self._Elements_Contents[element] = content
+        ratio = self._Atomic_Ratio_Matrix
+        if ratio is None:
+            return
+        
+        if element not in self.Ratio_Index:
+            n = len(self.Ratio_Elements)
+            self._Atomic_Ratio_Matrix = np.empty((n+1, n+1))
+            self._Atomic_Ratio_Matrix[:n, :n] = ratio
+            ratio = self._Atomic_Ratio_Matrix
+            self.Ratio_Index[element] = n
+            self.Ratio_Elements.append(element)
+        
+        i = self.Ratio_Index[element]
+        contents = np.array([self._Elements_Contents[other] for other in self.Ratio_Elements], dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio[i, :] = contents[i] / contents
+            ratio[:, i] = contents / contents[i]
+    
+    def load_full_scan(self):
+        if self.full_scan_address is not None:
+            address, self.full_scan_address = self.full_scan_address, None
+            self.read_full_scan(address)
+    
+    @property
+    def Full_Scan_BE_raw(self):
+        '''Full scan BE as stored, an EnergyAxis when evenly spaced.'''
+        self.load_full_scan()
+        return self._Full_Scan_BE
+    
+    @property
+    def Full_Scan_BE(self):
+        BE = self.Full_Scan_BE_raw
+        return None if BE is None else np.asarray(BE)
+    
+    @Full_Scan_BE.setter
+    def Full_Scan_BE(self, Full_Scan_BE):
+        self.full_scan_address = None
+        self._Full_Scan_BE = Full_Scan_BE
+    
+    @property
+    def Full_Scan_Intensity(self):
+        self.load_full_scan()
+        return self._Full_Scan_Intensity
+    
+    @Full_Scan_Intensity.setter
+    def Full_Scan_Intensity(self, Full_Scan_Intensity):
+        self.full_scan_address = None
+        self._Full_Scan_Intensity = Full_Scan_Intensity
+    
+    def read_element_content(self, address):
+        cached = self.cache.get(address, 'element_content') if self.cache else None
+        if cached is not None:
+            self.Elements_Contents = dict(cached[0]['Elements_Contents'])
+            return
+        
+        import pandas as pd
+        file = pd.read_table(address)
+        elements = file.values[-2:][0][0].strip().split()
+        contents = file.values[-2:][1][0].strip().split()
+        self.Elements_Contents = dict(zip(elements, list(map(float, contents))))
+        
+        if self.cache:
+            self.cache.put(address, 'element_content', {'Elements_Contents': self._Elements_Contents}, {})
+
+    def read_full_scan(self, address):
+        cached = self.cache.get(address, 'full_scan') if self.cache else None
+        if cached is not None:
+            meta, arrays = cached
+            self.Full_Scan_BE = get_BE(meta, arrays, 'BE')
+            self.Full_Scan_Intensity = arrays['Intensity']
+            return
+        
+        import pandas as pd
+        file = pd.read_csv(address,
+                           names = ['BE', 'Intensity'],
+                           skiprows = 4)
+        
+        self.Full_Scan_BE = EnergyAxis.from_array(file['BE'].values)
+        self.Full_Scan_Intensity = file['Intensity'].values
+        
+        if self.cache:
+            meta, arrays = {}, {'Intensity': self.Full_Scan_Intensity}
+            put_BE(meta, arrays, 'BE', self.Full_Scan_BE_raw)
+            self.cache.put(address, 'full_scan', meta, arrays)
+        
+    def read_fine_scan(self, address):
+        '''
+        Single pass over N-a.csv: the 4 header lines (element names on the 3rd)
+        and the data table are read from the same file handle. Each element
+        keeps the leading rows of its columns up to the NaN padding, as
+        contiguous slices of one Fortran-ordered array.
+        '''
+        cached = self.cache.get(address, 'fine_scan') if self.cache else None
+        if cached is not None:
+            meta, arrays = cached
+            self.Fine_Scan_Elements = list(meta['Fine_Scan_Elements'])
+            for element in self.Fine_Scan_Elements:
+                self.Fine_Scan_BE_raw[element] = get_BE(meta, arrays, f'BE/{element}')
+                self.Fine_Scan_Intensity[element] = arrays[f'Intensity/{element}']
+            return
+        
+        import pandas as pd
+        with open(address, 'r') as f:
+            header = [f.readline() for _ in range(4)]
+            self.Fine_Scan_Elements = header[2].rstrip('\r\n').split(',')[::2]
+            
+            values = pd.read_csv(f,
+                                 header = None,
+                                 names = range(2*len(self.Fine_Scan_Elements))).to_numpy(dtype=np.float64)
+        
+        values = np.asfortranarray(values)
+        points = np.count_nonzero(~np.isnan(values[:, ::2]), axis=0)
+        
+        for i, element in enumerate(self.Fine_Scan_Elements):
+            self.Fine_Scan_BE_raw[element] = read_only(EnergyAxis.from_array(values[:points[i], 2*i]))
+            self.Fine_Scan_Intensity[element] = values[:points[i], 2*i+1]
+        
+        if self.cache:
+            meta, arrays = {'Fine_Scan_Elements': self.Fine_Scan_Elements}, {}
+            for element in self.Fine_Scan_Elements:
+                put_BE(meta, arrays, f'BE/{element}', self.Fine_Scan_BE_raw[element])
+                arrays[f'Intensity/{element}'] = self.Fine_Scan_Intensity[element]
+            self.cache.put(address, 'fine_scan', meta, arrays)
+    
+    def read_spe(self, addresses):
+        '''
+        Read the regions of one or more PHI .SPE files directly,
+        survey regions (Su1s) go to the full scan, the others to the fine scans.
+        The intensities are copied out of the memory map and each file is
+        closed right away, so it is not kept open (locked on Windows).
+        '''
+        self.Fine_Scan_Elements = []
+        
+        for address in addresses:
+            with SpeFile(address) as spe:
+                for name in spe.names:
+                    BE, Intensity = spe[name]
+                    points = min(len(BE), len(Intensity))
+                    # no view on the map may outlive the with block
+                    BE, Intensity = BE[:points], np.array(Intensity[:points])
+                    if name.lower().startswith('su'):
+                        self.Full_Scan_BE = BE
+                        self.Full_Scan_Intensity = Intensity
+                    elif name not in self.Fine_Scan_Elements:
+                        self.Fine_Scan_Elements.append(name)
+                        self.Fine_Scan_BE_raw[name] = read_only(BE)
+                        self.Fine_Scan_Intensity[name] = Intensity
+        
+        # no quantification in .SPE files
+        self.Elements_Contents = dict.fromkeys(self.Fine_Scan_Elements, 0)
+    
+    def read_xps(self, address):
+        '''
+        Read back the fine scans of an XPSPEAK 4.0 file written by save_xps.
+        BE and Intensity come straight from the float32 blocks (np.frombuffer).
+        Regions are named from the 20-byte label of each block (the element
+        name for files from save_xps), or Region1, Region2 ... when it is blank.
+        A truncated file raises ValueError.
+        '''
+        with open(address, 'rb') as f:
+            s = f.read()
+        
+        if s[:11] != b'\x58\x50\x53\x50\x45\x41\x4b\x20\x34\x2e\x30':
+            raise ValueError(f'{address} is not an XPSPEAK 4.0 file.')
+        
+        self.Fine_Scan_Elements = []
+        
+        pos = 11
+        while s[pos:pos+2] == b'\x44\x50':
+            points, = unpack_from('<h', s, pos+2) if len(s) >= pos+4 else (-1,)
+            if points < 0 or len(s) < pos + 236 + 32*points:
+                raise ValueError(f'{address} is truncated (region {len(self.Fine_Scan_Elements)+1}).')
+            name = s[pos+8:pos+28].decode('latin1').strip() or f'Region{len(self.Fine_Scan_Elements)+1}'
+            BE = np.frombuffer(s, dtype='<f4', count=points, offset=pos+44)
+            Intensity = np.frombuffer(s, dtype='<f4', count=points, offset=pos+58+4*points)
+            
+            self.Fine_Scan_Elements.append(name)
+            self.Fine_Scan_BE_raw[name] = read_only(EnergyAxis.from_array(BE))
+            self.Fine_Scan_Intensity[name] = Intensity
+            pos += 236 + 32*points
+        
+        self.Elements_Contents = dict.fromkeys(self.Fine_Scan_Elements, 0)
+    
+    def Elements_Contents_Update(self):
+        if len(self.Fine_Scan_Elements) > len(self.Elements_Contents):
+            elements = list(set(self.Fine_Scan_Elements).difference(set(self.Elements_Contents)))
+            for element in elements:
+                self.set_element_content(element, 0)
+    
+    def calibrate_BE(self, delta_BE=None):
+        '''
+        Set the calibration offset, relative to the imported (raw) BE.
+        Nothing is recomputed here, Fine_Scan_BE applies it on access.
+        '''
+        if delta_BE is not None:
+            self.delta_BE = delta_BE
+    
+    def undo_calibration(self):
+        self.delta_BE = 0.0
+    
+    def find_reference_peak(self, element='C1s', smooth=5, fit=3):
+        '''
+        Raw B.E. of the maximum of the element's fine scan: the intensity is
+        smoothed with a 'smooth'-point moving average, and a parabola is fitted
+        to the 2*fit+1 smoothed points around the highest one, so the result is
+        not limited to the step size.
+        '''
+        BE = np.asarray(self.Fine_Scan_BE_raw[element], dtype=np.float64)
+        Intensity = np.asarray(self.Fine_Scan_Intensity[element], dtype=np.float64)
+        
+        smooth = max(1, min(smooth, len(Intensity)) // 2 * 2 + 1)
+        smoothed = np.convolve(np.pad(Intensity, smooth//2, mode='edge'), np.ones(smooth)/smooth, mode='valid')
+        
+        i = int(np.argmax(smoothed))
+        window = slice(max(i-fit, 0), min(i+fit+1, len(BE)))
+        if window.stop - window.start < 3:
+            return BE[i]
+        
+        # fit around BE[i] for a well conditioned polynomial
+        a, b, _ = np.polyfit(BE[window] - BE[i], smoothed[window], 2)
+        if a >= 0:
+            return BE[i]
+        return BE[i] + np.clip(-b / (2*a), BE[window].min() - BE[i], BE[window].max() - BE[i])
+    
+    def auto_calibrate(self, element='C1s', standard_BE=284.5, smooth=5, fit=3):
+        '''Calibrate so that the detected reference peak sits at standard_BE, return delta_BE.'''
+        self.calibrate_BE(standard_BE - self.find_reference_peak(element, smooth, fit))
+        return self.delta_BE
+
+    def check_files(self, file_names, file_address):
+        if len(file_names) != 0 and all(file_name.lower().endswith('.spe') for file_name in file_names):
+            self.initial_data()
+            try:
+                self.read_spe(file_names)
+            except (OSError, ValueError, KeyError, IndexError):
+                # truncated or corrupt file, nothing is kept from it
+                self.initial_data()
+                return False
+            self.Elements_Contents_Update()
+            self.delta_BE = 0.0
+            return True
+        
+        if len(file_names) == 1 and file_names[0].lower().endswith('.xpp'):
+            # a project holding only a comparison set imports nothing
+            self.initial_data()
+            try:
+                load_session(file_names[0], self)
+            except (OSError, ValueError):
+                self.initial_data()
+            return self.Fine_Scan_Elements is not None
+        
+        if len(file_names) == 1 and file_names[0].lower().endswith('.xps'):
+            self.initial_data()
+            try:
+                self.read_xps(file_names[0])
+            except ValueError:
+                self.initial_data()
+                return False
+            self.delta_BE = 0.0
+            return True
+        
+        correct_file_names = [f'{file_address}N-a.txt', f'{file_address}S-a.csv', f'{file_address}N-a.csv']
+        
+        if len(file_names) == 3 and set(file_names).difference(set(correct_file_names)) == set():
+            # only the fine scans now, the element contents and the
+            # full scan are parsed when first used
+            self.initial_data()
+            self.read_fine_scan(correct_file_names[2])
+            self.element_content_address = correct_file_names[0]
+            self.full_scan_address = correct_file_names[1]
+            self.delta_BE = 0.0
+            return True
+        else:
+            return False
+    
+    def calculate_atomic_ratio(self, element_1, element_2):
+        # builds Ratio_Index, empty if nothing is imported (KeyError)
+        ratio = self.Atomic_Ratio_Matrix
+        ratio = ratio[self.Ratio_Index[element_1], self.Ratio_Index[element_2]]
+        if not np.isfinite(ratio):
+            raise ZeroDivisionError(f'{element_2} content is 0')
+        return f'{ratio:.2f}'
+    
+    def atomic_ratio_frame(self):
+        '''The ratio matrix as a DataFrame (row / column), for display.'''
+        import pandas as pd
+        return pd.DataFrame(self.Atomic_Ratio_Matrix, index=self.Ratio_Elements, columns=self.Ratio_Elements)
+    
+    def atomic_ratios(self):
+        '''All ratios of different elements, {'element_1/element_2': ratio}, nan for a zero denominator.'''
+        ratio = self.Atomic_Ratio_Matrix
+        return {f'{element_1}/{element_2}': float(ratio[i, j]) if np.isfinite(ratio[i, j]) else np.nan
+                for i, element_1 in enumerate(self.Ratio_Elements)
+                for j, element_2 in enumerate(self.Ratio_Elements) if i != j}
+    
+    def save_txt(self, address, fmt='%f', chunk=65536):
+        '''
+        One '{address}{element}.txt' per element, same layout as np.savetxt,
+        but formatted 'chunk' rows at a time with a single % operation.
+        '''
+        line = f'{fmt} {fmt}\n'
+        for element in self.Fine_Scan_Elements:
+            data = np.column_stack((self.Fine_Scan_BE[element], self.Fine_Scan_Intensity[element]))
+            with open(f'{address}{element}.txt', 'w') as f:
+                for i in range(0, len(data), chunk):
+                    block = data[i:i+chunk]
+                    f.write((line * len(block)) % tuple(block.ravel()))
+    
+    def save_npz(self, path, compress=True):
+        '''
+        All calibrated fine scans, the full scan and the element contents in one
+        .npz archive, at full float64 precision:
+        Elements, Contents, delta_BE, Full_Scan_BE, Full_Scan_Intensity,
+        {element}_BE, {element}_Intensity.
+        '''
+        arrays = {'Elements': np.array(list(self.Elements_Contents), dtype=str),
+                  'Contents': np.array(list(self.Elements_Contents.values()), dtype=np.float64),
+                  'delta_BE': np.float64(self.delta_BE or 0.0)}
+        if self.Full_Scan_BE is not None:
+            arrays['Full_Scan_BE'] = np.asarray(self.Full_Scan_BE)
+            arrays['Full_Scan_Intensity'] = np.asarray(self.Full_Scan_Intensity)
+        for element in self.Fine_Scan_Elements:
+            arrays[f'{element}_BE'] = np.asarray(self.Fine_Scan_BE[element])
+            arrays[f'{element}_Intensity'] = np.asarray(self.Fine_Scan_Intensity[element])
+        
+        if compress:
+            np.savez_compressed(path, **arrays)
+        else:
+            np.savez(path, **arrays)
+    
+    def save_xps(self, path):
+        '''
+        XPSPEAK 4.0 file. Every region block is laid out in one preallocated
+        bytearray, BE and Intensity are copied in as float32 buffers.
+        The template pads the file to 61 regions, more regions are written
+        without padding. The element name goes into the 20-byte label of its
+        block (space padded), so read_xps gets the elements back.
+        '''
+        num = len(self.Fine_Scan_Elements)
+        regions = [(np.asarray(self.Fine_Scan_BE[element], dtype=np.float64),
+                    np.asarray(self.Fine_Scan_Intensity[element], dtype=np.float64))
+                   for element in self.Fine_Scan_Elements]
+        
+        # block: head 30 + 2 * (14 + 4*points) + tail 76 + 6 * (14 + 4*points) + 18
+        size = 11 + sum(236 + 32*len(BE) for BE, _ in regions) + 2*max(61-num, 0) + 84
+        s = bytearray(size)
+        s[0:11] = b'\x58\x50\x53\x50\x45\x41\x4b\x20\x34\x2e\x30'
+        
+        pos = 11
+        for element, (BE, Intensity) in zip(self.Fine_Scan_Elements, regions):
+            points = len(BE)
+            label = element.encode('latin1', 'replace')[:20].ljust(20, b'\x20')
+            pack_into('<2sh4s20sh', s, pos, b'\x44\x50', points, b'\xff\xff\x00\x00', label, points)
+            pos += 30
+            for values in (BE, Intensity):
+                pack_into('<hh', s, pos, 1, points+1)
+                np.frombuffer(s, dtype='<f4', count=points, offset=pos+14)[:] = values
+                pos += 14 + 4*points
+            pack_into('<4f', s, pos, np.max(BE), np.min(BE), np.max(Intensity), np.min(Intensity))
+            pos += 76
+            for _ in range(6):
+                pack_into('<hh', s, pos, 1, points+1)
+                pos += 14 + 4*points
+            pos += 18
+        
+        s[pos:pos+2*max(61-num, 0)] = b'\x44\x41'*max(61-num, 0)
+        s[-4:] = b'\x08\x00\x00\x00'
+        
+        with open(path, 'wb') as f:
+            f.write(s)
+
+
+def atomic_ratio_table(manips, names=None):
+    '''One row per sample, one column per element pair 'element_1/element_2'.'''
+    import pandas as pd
+    names = list(names) if names is not None else list(range(len(manips)))
+    return pd.DataFrame([manip.atomic_ratios() for manip in manips], index=names)
+
+
+def calibrate_series(manips, element='C1s', standard_BE=284.5, names=None, smooth=5, fit=3, step=None, outlier=3.5, apply=True):
+    '''
+    Charge correction of a whole series with one reference peak.
+    
+    The reference regions of all samples are interpolated onto one common,
+    ascending B.E. grid (finest step of the series unless 'step' is given)
+    and stacked into a 2D array; smoothing, peak search and the parabolic
+    refinement over 2*fit+1 points then run on all samples at once.
+    Samples whose delta_BE is more than 'outlier' robust z-scores
+    (median / MAD) away from the median are flagged.
+    
+    Return a DataFrame with sample, peak_BE, delta_BE, outlier; with
+    apply=True every sample is also calibrated. Samples without the
+    reference region get NaN and outlier <NA> (nullable boolean).
+    '''
+    import pandas as pd
+    
+    names = list(names) if names is not None else list(range(len(manips)))
+    rows = [k for k, manip in enumerate(manips)
+            if manip.Fine_Scan_Elements is not None and element in manip.Fine_Scan_Elements]
+    peak_BE = np.full(len(manips), np.nan)
+    
+    if rows:
+        regions = [(np.asarray(manips[k].Fine_Scan_BE_raw[element], dtype=np.float64),
+                    np.asarray(manips[k].Fine_Scan_Intensity[element], dtype=np.float64)) for k in rows]
+        if step is None:
+            # repeated B.E. points give zero differences, they are ignored
+            steps = [np.abs(np.diff(BE)) for BE, _ in regions]
+            steps = [diff[diff > 0].min() for diff in steps if np.any(diff > 0)]
+            step = min(steps, default=0.0)
+        if not step > 0:
+            raise ValueError(f'no B.E. step of {element} > 0, give step explicitly.')
+        low = min(BE.min() for BE, _ in regions)
+        high = max(BE.max() for BE, _ in regions)
+        grid = low + step * np.arange(int(round((high - low) / step)) + 1)
+        
+        # one row per sample, NaN outside its own range
+        stack = np.empty((len(rows), len(grid)))
+        for j, (BE, Intensity) in enumerate(regions):
+            order = np.argsort(BE)
+            stack[j] = np.interp(grid, BE[order], Intensity[order], left=np.nan, right=np.nan)
+        valid = ~np.isnan(stack)
+        stack = np.where(valid, stack, np.nanmin(stack, axis=1, keepdims=True))
+        
+        # moving average along the grid, edges padded with their own values
+        smooth = max(1, min(smooth, len(grid)) // 2 * 2 + 1)
+        padded = np.pad(stack, ((0, 0), (smooth//2, smooth//2)), mode='edge')
+        cumsum = np.concatenate([np.zeros((len(rows), 1)), np.cumsum(padded, axis=1)], axis=1)
+        smoothed = (cumsum[:, smooth:] - cumsum[:, :-smooth]) / smooth
+        smoothed[~valid] = -np.inf
+        
+        index = np.argmax(smoothed, axis=1)
+        
+        # least squares parabola on the uniform grid: closed form for offsets t = -fit..fit
+        t = np.arange(-fit, fit+1)
+        columns = np.clip(index[:, None] + t, 0, len(grid) - 1)
+        window = np.take_along_axis(smoothed, columns, axis=1)
+        inside = (index - fit >= 0) & (index + fit < len(grid)) & np.all(np.isfinite(window), axis=1)
+        window = np.where(np.isfinite(window), window, 0.0)
+        b = window @ t / np.sum(t**2)
+        a = window @ (t**2 - np.mean(t**2)) / np.sum((t**2 - np.mean(t**2))**2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            offset = np.where(inside & (a < 0), np.clip(-b / (2*a), -fit, fit), 0.0)
+        
+        peak_BE[rows] = grid[index] + offset * step
+    
+    delta_BE = standard_BE - peak_BE
+    median = np.nanmedian(delta_BE) if rows else np.nan
+    deviation = np.abs(delta_BE - median)
+    mad = np.nanmedian(deviation) if rows else np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # MAD of 0: any deviation is an outlier (inf), none is not (nan)
+        flagged = np.nan_to_num(0.6745 * deviation / mad, nan=0.0) > outlier
+    
+    if apply:
+        for k in rows:
+            manips[k].calibrate_BE(float(delta_BE[k]))
+    
+    flagged = pd.array(flagged, dtype='boolean')
+    flagged[np.isnan(peak_BE)] = pd.NA
+    
+    return pd.DataFrame({'sample': names,
+                         'peak_BE': peak_BE,
+                         'delta_BE': delta_BE,
+                         'outlier': flagged})
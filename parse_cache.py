@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#coding:utf-8
+# =============================================================================
+# On-disk cache of parsed export files
+#
+# One entry per (file, reader), named after a hash of the absolute path,
+# size and mtime of the source file, so an edited or replaced file is never
+# served from the cache. Entries use the project file layout (project.py)
+# and are memory-mapped on read.
+#
+# The mtime of an entry is its last use; when the cache grows over
+# max_size bytes the least recently used entries are removed.
+# =============================================================================
+
+import hashlib
+import os
+
+from project import write_project, read_project
+
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.xpspre_cache')
+MAX_SIZE = 512 * 1024**2
+
+
+class ParseCache():
+
+    def __init__(self, directory=CACHE_DIR, max_size=MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+    def entry(self, address, kind):
+        stat = os.stat(address)
+        identity = f'{os.path.abspath(address)}|{stat.st_size}|{stat.st_mtime_ns}|{kind}'
+        return os.path.join(self.directory, f'{hashlib.sha1(identity.encode("utf8")).hexdigest()}.xpp')
+
+    def get(self, address, kind):
+        '''Return (meta, arrays) of the cached parse of address, None on a miss.'''
+        try:
+            entry = self.entry(address, kind)
+            meta, arrays = read_project(entry)
+            os.utime(entry)
+        except (OSError, ValueError):
+            return None
+        return meta, arrays
+
+    def put(self, address, kind, meta, arrays):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            entry = self.entry(address, kind)
+            # write_project swaps the new file in with os.replace
+            write_project(entry, meta, arrays)
+        except OSError:
+            # a cache that can not be written only costs the next parse
+            return
+        self.evict()
+
+    def evict(self):
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        with os.scandir(self.directory) as it:
+            for item in it:
+                if item.name.endswith('.xpp'):
+                    stat = item.stat()
+                    entries.append((stat.st_mtime, stat.st_size, item.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # still mapped (Windows) or removed by another process
+                continue
+            total -= size
+
+    def clear(self):
+        max_size, self.max_size = self.max_size, 0
+        try:
+            self.evict()
+        finally:
+            self.max_size = max_size
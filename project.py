@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+#coding:utf-8
+# =============================================================================
+# XPSPRE project file (.xpp)
+#
+# (1) 16 bytes: magic b'XPSPRE\x00\x00', uint32 version, uint32 header length
+# (2) JSON header (utf8):
+#       {"version": 1,
+#        "meta": {...},
+#        "arrays": {name: {"dtype": "<f8", "shape": [n], "offset": o}}}
+# (3) raw array data, starting at the first multiple of 64 after the header,
+#     every array aligned to 64 bytes, 'offset' is relative to that start.
+#
+# read_project memory-maps the file and returns read-only np.frombuffer views,
+# so only the arrays actually used are paged in.
+# =============================================================================
+
+import json
+import mmap
+import os
+from struct import pack, unpack
+
+import numpy as np
+
+from energy_axis import EnergyAxis
+
+
+MAGIC = b'XPSPRE\x00\x00'
+VERSION = 1
+ALIGN = 64
+
+
+def aligned(n):
+    return -(-n // ALIGN) * ALIGN
+
+
+def write_project(path, meta, arrays):
+    '''meta: JSON serialisable dict, arrays: {name: numeric ndarray}.'''
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+
+    entries = {}
+    offset = 0
+    for name, array in arrays.items():
+        entries[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += aligned(array.nbytes)
+
+    header = json.dumps({'version': VERSION, 'meta': meta, 'arrays': entries}).encode('utf8')
+    data_start = aligned(16 + len(header))
+
+    # arrays may be views on a memory map of path itself (read_project):
+    # write a new file and swap it in, never truncate the mapped one
+    with open(f'{path}.tmp', 'wb') as f:
+        f.write(MAGIC + pack('<II', VERSION, len(header)) + header)
+        for name, array in arrays.items():
+            f.seek(data_start + entries[name]['offset'])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(f'{path}.tmp', path)
+
+
+def read_project(path):
+    '''Return (meta, {name: read-only array view on the memory-mapped file}).'''
+    with open(path, 'rb') as f:
+        head = f.read(16)
+        if len(head) != 16 or head[:8] != MAGIC:
+            raise ValueError(f'{path} is not an XPSPRE project file.')
+        version, length = unpack('<II', head[8:])
+        if version > VERSION:
+            raise ValueError(f'{path} was written by a newer XPSPRE (project version {version}).')
+        header = json.loads(f.read(length).decode('utf8'))
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    data_start = aligned(16 + length)
+    arrays = {}
+    for name, entry in header['arrays'].items():
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape'], dtype=np.int64))
+        arrays[name] = np.frombuffer(mm, dtype=dtype, count=count,
+                                     offset=data_start + entry['offset']).reshape(entry['shape'])
+    return header['meta'], arrays
+
+
+def put_BE(meta, arrays, name, BE):
+    '''Store BE under name: (start, step, points) in meta['axes'] for an EnergyAxis.'''
+    if isinstance(BE, EnergyAxis):
+        meta.setdefault('axes', {})[name] = [BE.start, BE.step, BE.points]
+    else:
+        arrays[name] = np.asarray(BE, dtype=np.float64)
+
+
+def get_BE(meta, arrays, name):
+    if name in meta.get('axes', {}):
+        return EnergyAxis(*meta['axes'][name])
+    return arrays.get(name)
+
+
+def save_session(path, manip=None, comparison=None):
+    '''
+    Save a Manipulation (raw arrays, calibration offset, element contents)
+    and/or a ComparationWindow data set (DataFrame) into one project file.
+    Evenly spaced BE are stored as (start, step, points) only.
+    '''
+    meta = {'axes': {}}
+    arrays = {}
+
+    if manip is not None and manip.Fine_Scan_Elements is not None:
+        meta['delta_BE'] = manip.delta_BE or 0.0
+        meta['Elements_Contents'] = dict(manip.Elements_Contents)
+        meta['Fine_Scan_Elements'] = list(manip.Fine_Scan_Elements)
+        if manip.Full_Scan_BE_raw is not None:
+            put_BE(meta, arrays, 'Full_Scan_BE', manip.Full_Scan_BE_raw)
+            arrays['Full_Scan_Intensity'] = np.asarray(manip.Full_Scan_Intensity, dtype=np.float64)
+        for element in manip.Fine_Scan_Elements:
+            put_BE(meta, arrays, f'Fine_Scan_BE/{element}', manip.Fine_Scan_BE_raw[element])
+            arrays[f'Fine_Scan_Intensity/{element}'] = np.asarray(manip.Fine_Scan_Intensity[element])
+
+    if comparison is not None:
+        meta['comparison'] = [str(column) for column in comparison.columns]
+        for column in comparison.columns:
+            arrays[f'comparison/{column}'] = comparison[column].to_numpy(dtype=np.float64)
+
+    write_project(path, meta, arrays)
+
+
+def load_session(path, manip=None):
+    '''
+    Load a project file. The Manipulation part goes into manip (if given),
+    the comparison data set is returned as a DataFrame (None if absent).
+    '''
+    meta, arrays = read_project(path)
+
+    if manip is not None and 'Fine_Scan_Elements' in meta:
+        manip.initial_data()
+        manip.Elements_Contents = dict(meta['Elements_Contents'])
+        manip.Fine_Scan_Elements = list(meta['Fine_Scan_Elements'])
+        manip.Full_Scan_BE = get_BE(meta, arrays, 'Full_Scan_BE')
+        manip.Full_Scan_Intensity = arrays.get('Full_Scan_Intensity')
+        for element in manip.Fine_Scan_Elements:
+            manip.Fine_Scan_BE_raw[element] = get_BE(meta, arrays, f'Fine_Scan_BE/{element}')
+            manip.Fine_Scan_Intensity[element] = arrays[f'Fine_Scan_Intensity/{element}']
+        manip.delta_BE = meta['delta_BE']
+
+    if 'comparison' in meta:
+        import pandas as pd
+        return pd.DataFrame({column: arrays[f'comparison/{column}'] for column in meta['comparison']})
+    return None
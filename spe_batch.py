@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+#coding:utf-8
+# =============================================================================
+# Batch ingestion of PHI MultiPak .SPE files
+#
+#   python spe_batch.py D:/XPS/2020 spectra.parquet --workers 8
+#
+# Every .SPE file under the directory tree is decoded in a process pool and
+# all regions end up in one long (tidy) columnar table:
+#   file | FileDate | AcqFilename | XraySource | area | cycle | name | Epass |
+#   BE | Intensity
+# one row per data point of every spectrum (all spatial areas and cycles),
+# file/area/name/... stored as categoricals. The table is written to Parquet
+# (.parquet, needs pyarrow or fastparquet) or to HDF5 (.h5/.hdf5, needs
+# PyTables).
+# =============================================================================
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from PHIMultipakSPE_reader import SpeFile
+
+
+META = ['FileDate', 'AcqFilename', 'XraySource']
+
+
+def find_spe_files(root):
+    return [os.path.join(dirpath, file_name)
+            for dirpath, _, file_names in os.walk(root)
+            for file_name in sorted(file_names) if file_name.lower().endswith('.spe')]
+
+
+def decode_file(file_path):
+    '''
+    Worker: decode every spectrum (all areas and cycles) of one file into
+    flat arrays. Return None if the file can not be read.
+    '''
+    # a truncated or corrupt file fails in the headers (ValueError) or when
+    # a region points past the end of the file (ValueError from frombuffer)
+    try:
+        with SpeFile(file_path) as spe:
+            if not spe.names:
+                return None
+            names, areas = [], []
+            cycles = np.empty(spe.spectranum, dtype=np.int64)
+            lengths = np.empty(spe.spectranum, dtype=np.int64)
+            Epass = np.empty(spe.spectranum, dtype=np.float64)
+            BE, Intensity = [], []
+            for i, (area, cycle, name, x, y) in enumerate(spe.iter_spectra()):
+                n = min(len(x), len(y))
+                names.append(name)
+                areas.append(area)
+                cycles[i] = cycle
+                lengths[i] = n
+                Epass[i] = spe.SpectralRegDef[i % len(spe.names)].Epass
+                BE.append(np.asarray(x[:n]))
+                Intensity.append(y[:n])
+
+            return {'file': file_path,
+                    'meta': [spe.ascii_header.get(key, '') for key in META],
+                    'names': names,
+                    'areas': areas,
+                    'cycles': cycles,
+                    'lengths': lengths,
+                    'Epass': Epass,
+                    'BE': np.concatenate(BE),
+                    'Intensity': np.concatenate(Intensity).astype(np.float64)}
+    except (OSError, ValueError, KeyError, IndexError):
+        return None
+
+
+def ingest(root, workers=None):
+    '''Decode every .SPE file under root, return the long DataFrame.'''
+    file_paths = find_spe_files(root)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = [result for result in executor.map(decode_file, file_paths, chunksize=8)
+                   if result is not None]
+
+    if not results:
+        return pd.DataFrame(columns=['file'] + META + ['area', 'cycle', 'name', 'Epass', 'BE', 'Intensity'])
+
+    # per spectrum codes, expanded to per point codes with one np.repeat each
+    files = [result['file'] for result in results]
+    names = sorted({name for result in results for name in result['names']})
+    name_code = {name: i for i, name in enumerate(names)}
+    areas = sorted({area for result in results for area in result['areas']})
+    area_code = {area: i for i, area in enumerate(areas)}
+
+    lengths = np.concatenate([result['lengths'] for result in results])
+    file_codes = np.concatenate([np.full(len(result['names']), i) for i, result in enumerate(results)])
+    name_codes = np.array([name_code[name] for result in results for name in result['names']], dtype=np.int64)
+    area_codes = np.array([area_code[area] for result in results for area in result['areas']], dtype=np.int64)
+    point_file_codes = np.repeat(file_codes, lengths)
+
+    data = {'file': pd.Categorical.from_codes(point_file_codes, categories=files)}
+    for j, key in enumerate(META):
+        values = pd.Categorical([result['meta'][j] for result in results])
+        data[key] = pd.Categorical.from_codes(values.codes[point_file_codes], categories=values.categories)
+    data['area'] = pd.Categorical.from_codes(np.repeat(area_codes, lengths), categories=areas)
+    data['cycle'] = np.repeat(np.concatenate([result['cycles'] for result in results]), lengths)
+    data['name'] = pd.Categorical.from_codes(np.repeat(name_codes, lengths), categories=names)
+    data['Epass'] = np.repeat(np.concatenate([result['Epass'] for result in results]), lengths)
+    data['BE'] = np.concatenate([result['BE'] for result in results])
+    data['Intensity'] = np.concatenate([result['Intensity'] for result in results])
+
+    return pd.DataFrame(data)
+
+
+def write(data, out_path):
+    if out_path.lower().endswith(('.h5', '.hdf5')):
+        data.to_hdf(out_path, key='spectra', format='table')
+    else:
+        data.to_parquet(out_path, index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Decode a directory tree of .SPE files into one columnar file.')
+    parser.add_argument('root', help='directory searched recursively for .SPE files')
+    parser.add_argument('out_path', help='output file, .parquet or .h5')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: all cores)')
+    args = parser.parse_args(argv)
+
+    data = ingest(args.root, args.workers)
+    write(data, args.out_path)
+    print(f"{data['file'].nunique()} files, {len(data)} points -> {args.out_path}")
+
+
+if __name__ == '__main__':
+    main()
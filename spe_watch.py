@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+#coding:utf-8
+# =============================================================================
+# Watch-folder ingestion of PHI MultiPak .SPE files
+#
+#   python spe_watch.py D:/Acquisition D:/Decoded --interval 2
+#
+# The acquisition directory is polled every 'interval' seconds. A new or
+# updated .SPE file is taken as complete once its size and mtime did not
+# change between two polls and it parses. All its spectra (every area and
+# cycle) are then written to OUT_DIR/<relative path>.npz as
+# {area}/{cycle}/{name}_BE / {area}/{cycle}/{name}_Intensity arrays.
+#
+# Processed files are recorded with their size and mtime in a JSON ledger
+# (OUT_DIR/ledger.json by default), so a restart only picks up files that
+# are new or changed since.
+# =============================================================================
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from PHIMultipakSPE_reader import SpeFile
+
+
+class Ledger():
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, 'r', encoding='utf8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def done(self, file_path, identity):
+        return self.entries.get(file_path) == list(identity)
+
+    def add(self, file_path, identity):
+        self.entries[file_path] = list(identity)
+        # write to a temporary file first, an interrupted dump never
+        # leaves a truncated ledger behind
+        with open(f'{self.path}.tmp', 'w', encoding='utf8') as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(f'{self.path}.tmp', self.path)
+
+
+class SpeWatcher():
+
+    def __init__(self, watch_dir, out_dir, ledger_path=None):
+        self.watch_dir = watch_dir
+        self.out_dir = out_dir
+        os.makedirs(out_dir, exist_ok=True)
+        self.ledger = Ledger(ledger_path or os.path.join(out_dir, 'ledger.json'))
+        # file_path: (size, mtime_ns) seen at the previous poll
+        self.pending = {}
+        # file_path: (size, mtime_ns) of files that failed to parse
+        self.failed = {}
+
+    def scan(self):
+        stack = [self.watch_dir]
+        while stack:
+            # files and folders removed between listing and stat are skipped,
+            # they are simply not there at the next poll
+            try:
+                entries = os.scandir(stack.pop())
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith('.spe'):
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        yield entry.path, (stat.st_size, stat.st_mtime_ns)
+
+    def poll(self):
+        '''One pass over the watch directory, return the files processed.'''
+        processed = []
+        seen = {}
+
+        for file_path, identity in self.scan():
+            if self.ledger.done(file_path, identity) or self.failed.get(file_path) == identity:
+                continue
+            seen[file_path] = identity
+            # still being written if it changed since the last poll
+            if self.pending.get(file_path) != identity:
+                continue
+            del seen[file_path]
+            if self.process(file_path):
+                self.ledger.add(file_path, identity)
+                processed.append(file_path)
+            else:
+                self.failed[file_path] = identity
+
+        self.pending = seen
+        return processed
+
+    def process(self, file_path):
+        try:
+            with SpeFile(file_path) as spe:
+                arrays = {}
+                for area, cycle, name, BE, Intensity in spe.iter_spectra():
+                    key = f'{area}/{cycle}/{name}'
+                    # a region name repeated in the header gets _2, _3 ...
+                    k = 1
+                    while f'{key}_BE' in arrays:
+                        k += 1
+                        key = f'{area}/{cycle}/{name}_{k}'
+                    arrays[f'{key}_BE'] = np.asarray(BE)
+                    arrays[f'{key}_Intensity'] = Intensity
+                out_path = os.path.join(self.out_dir, f'{os.path.relpath(file_path, self.watch_dir)}.npz')
+                os.makedirs(os.path.dirname(out_path), exist_ok=True)
+                np.savez(out_path, **arrays)
+        except (OSError, ValueError, KeyError, IndexError):
+            # incomplete or unreadable, retried when it changes
+            return False
+        return True
+
+    def run(self, interval=2.0):
+        while True:
+            for file_path in self.poll():
+                print(f'{time.strftime("%H:%M:%S")}  {file_path}')
+            time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Decode .SPE files as they arrive in an acquisition directory.')
+    parser.add_argument('watch_dir', help='directory written by the instrument')
+    parser.add_argument('out_dir', help='directory for the decoded .npz files')
+    parser.add_argument('--interval', type=float, default=2.0, help='seconds between polls')
+    parser.add_argument('--ledger', default=None, help='ledger file (default: OUT_DIR/ledger.json)')
+    args = parser.parse_args(argv)
+
+    try:
+        SpeWatcher(args.watch_dir, args.out_dir, args.ledger).run(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
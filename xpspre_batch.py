@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#coding:utf-8
+# =============================================================================
+# Headless batch processing
+#
+#   python xpspre_batch.py D:/XPS/campaign --reference C1s --standard 284.5
+#                          --export txt xps --out summary.csv --workers 8
+#
+# Samples found under the directory tree:
+#   - every folder holding the N-a.txt / S-a.csv / N-a.csv triplet
+#   - every .SPE file
+# Each sample is imported, calibrated so that the maximum of the reference
+# peak (Manipulation.find_reference_peak) sits at the standard B.E., and
+# exported next to its files: .txt as the GUI does, .xps / .npz as
+# <address>spectra.xps / .npz. One row per sample (delta_BE, element
+# contents, atomic ratios) is collected into the summary CSV.
+# =============================================================================
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import pandas as pd
+
+from manipulation import Manipulation
+
+
+TRIPLET = ['N-a.txt', 'S-a.csv', 'N-a.csv']
+
+
+def find_samples(root):
+    '''Return [(file_names, file_address)], file_address as used by MainWindow.'''
+    samples = []
+    for dirpath, _, file_names in os.walk(root):
+        if set(TRIPLET).issubset(file_names):
+            address = dirpath + os.sep
+            samples.append(([f'{address}{file_name}' for file_name in TRIPLET], address))
+        for file_name in sorted(file_names):
+            if file_name.lower().endswith('.spe'):
+                file_path = os.path.join(dirpath, file_name)
+                samples.append(([file_path], f'{os.path.splitext(file_path)[0]}_'))
+    return samples
+
+
+def process_sample(sample, reference='C1s', standard=284.5, exports=('txt',)):
+    file_names, address = sample
+    row = {'sample': address}
+
+    manip = Manipulation()
+    # any failure (unreadable files, degenerate reference region, unwritable
+    # folder) only ends up in this sample's 'error' column
+    try:
+        if not manip.check_files(file_names, address):
+            row['error'] = 'not a valid sample'
+            return row
+
+        if reference in manip.Fine_Scan_Elements:
+            row['delta_BE'] = manip.auto_calibrate(reference, standard)
+        else:
+            # exported uncalibrated, not to be mistaken for a zero offset
+            row['delta_BE'] = float('nan')
+            row['error'] = f'no {reference} region, not calibrated'
+
+        # N-a.txt is only parsed here, on first access of Elements_Contents
+        for element, content in manip.Elements_Contents.items():
+            row[element] = content
+        row.update(manip.atomic_ratios())
+
+        if 'txt' in exports:
+            manip.save_txt(address)
+        if 'xps' in exports:
+            manip.save_xps(f'{address}spectra.xps')
+        if 'npz' in exports:
+            manip.save_npz(f'{address}spectra.npz')
+    except Exception as e:
+        row['error'] = f'{type(e).__name__}: {e}'
+
+    return row
+
+
+def run(root, reference='C1s', standard=284.5, exports=('txt',), workers=None):
+    samples = find_samples(root)
+    worker = partial(process_sample, reference=reference, standard=standard, exports=exports)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        rows = list(executor.map(worker, samples))
+
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import, calibrate and export all samples under a directory.')
+    parser.add_argument('root', help='directory searched recursively for export triplets and .SPE files')
+    parser.add_argument('--reference', default='C1s', help='reference element (default: C1s)')
+    parser.add_argument('--standard', type=float, default=284.5, help='standard B.E. of the reference peak (default: 284.5)')
+    parser.add_argument('--export', nargs='*', default=['txt'], choices=['txt', 'xps', 'npz'], help='export formats (default: txt)')
+    parser.add_argument('--out', default='summary.csv', help='summary table (default: summary.csv)')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: all cores)')
+    args = parser.parse_args(argv)
+
+    summary = run(args.root, args.reference, args.standard, args.export, args.workers)
+    summary.to_csv(args.out, index=False)
+    print(f'{len(summary)} samples -> {args.out}')
+
+
+if __name__ == '__main__':
+    main()